@@ -1,18 +1,34 @@
 """sqlite-vec helpers for chunk storage and vector search."""
 
 import sqlite3
-import struct
 from pathlib import Path
 
+import numpy as np
 import sqlite_vec
 
 
-def get_connection(db_path: str | Path) -> sqlite3.Connection:
-    """Open a connection with sqlite-vec loaded."""
-    conn = sqlite3.connect(str(db_path))
+def _load_vec(conn: sqlite3.Connection) -> None:
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
+
+
+def get_connection(db_path: str | Path) -> sqlite3.Connection:
+    """Open a connection with sqlite-vec loaded."""
+    conn = sqlite3.connect(str(db_path))
+    _load_vec(conn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_readonly_connection(db_path: str | Path) -> sqlite3.Connection:
+    """Open a read-only, memory-mapped connection with sqlite-vec loaded, for searching."""
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    _load_vec(conn)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
 
@@ -27,18 +43,100 @@ def init_db(db_path: str | Path) -> None:
             block_index INTEGER NOT NULL
         )
     """)
+    # Vectors are unit-normalized, then stored as int8 with one scale for the whole
+    # database (kept in meta), so the default L2 distance still ranks like cosine.
+    # vec0 is an exhaustive (flat) index. Each PDF gets its own chunks.db with at most a
+    # few thousand rows, where a flat scan is exact and fast; sqlite-vec has no ANN index yet.
     conn.execute("""
         CREATE VIRTUAL TABLE IF NOT EXISTS chunk_embeddings USING vec0(
-            embedding float[1536]
+            embedding int8[1536]
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
         )
     """)
     conn.commit()
     conn.close()
 
 
-def serialize_f32(vec: list[float]) -> bytes:
-    """Serialize a list of floats to a compact binary format for sqlite-vec."""
-    return struct.pack(f"{len(vec)}f", *vec)
+def init_cache_db(db_path: str | Path) -> None:
+    """Create the image description cache table."""
+    conn = get_connection(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS img_cache (
+            hash BLOB PRIMARY KEY,
+            description TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def get_cached_descriptions(conn: sqlite3.Connection, hashes: list[bytes]) -> dict[bytes, str]:
+    """Look up cached image descriptions. Returns {hash: description} for the hits."""
+    found = {}
+    for h in set(hashes):
+        row = conn.execute("SELECT description FROM img_cache WHERE hash = ?", (h,)).fetchone()
+        if row:
+            found[h] = row[0]
+    return found
+
+
+def cache_descriptions(conn: sqlite3.Connection, descriptions: dict[bytes, str]) -> None:
+    """Store image descriptions keyed by content hash, keeping any existing entry."""
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO img_cache (hash, description) VALUES (?, ?)",
+            descriptions.items(),
+        )
+
+
+def normalize(vecs: list[list[float]] | np.ndarray) -> np.ndarray:
+    """L2-normalize vectors to unit length. Returns a 2-D float32 array, one row per vector."""
+    arr = np.array(vecs, dtype=np.float32, ndmin=2)
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
+    return arr
+
+
+def quantize_int8(vecs: np.ndarray, scale: float) -> list[bytes]:
+    """Quantize vectors to int8 with a shared scale, clipping to ±127."""
+    return [row.tobytes() for row in np.clip(np.round(vecs * scale), -127, 127).astype(np.int8)]
+
+
+def _get_int8_scale(conn: sqlite3.Connection) -> float | None:
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'meta'").fetchone():
+        return None
+    row = conn.execute("SELECT value FROM meta WHERE key = 'int8_scale'").fetchone()
+    return row[0] if row else None
+
+
+def _encode_embeddings(
+    conn: sqlite3.Connection, vecs: list[list[float]], store_scale: bool = False
+) -> tuple[list[bytes], str]:
+    """Normalize and encode vectors for this database's chunk_embeddings column.
+
+    Returns (blobs, SQL placeholder). A chunks.db created before int8 storage has a
+    float[1536] column and gets float32 blobs; otherwise vectors are quantized with the
+    database's int8 scale, which the first insert derives from its batch (store_scale=True).
+    """
+    arr = normalize(vecs)
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'chunk_embeddings'").fetchone()
+    if row is None:
+        # e.g. a PDF that produced no chunks, where ingest never creates the tables
+        raise sqlite3.OperationalError("no such table: chunk_embeddings")
+    if "int8[" not in row[0]:
+        return [row.tobytes() for row in arr], "?"
+
+    scale = _get_int8_scale(conn)
+    if scale is None:
+        # Largest component in the corpus maps to ±127; later vectors are clipped to it
+        scale = float(127 / (np.abs(arr).max() + 1e-12))
+        if store_scale:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('int8_scale', ?)", (scale,))
+    return quantize_int8(arr, scale), "vec_int8(?)"
 
 
 def insert_chunk(conn: sqlite3.Connection, text: str, page: int, block_index: int, embedding: list[float]) -> int:
@@ -48,26 +146,54 @@ def insert_chunk(conn: sqlite3.Connection, text: str, page: int, block_index: in
         (text, page, block_index),
     )
     chunk_id = cur.lastrowid
+    blobs, placeholder = _encode_embeddings(conn, [embedding], store_scale=True)
     conn.execute(
-        "INSERT INTO chunk_embeddings (rowid, embedding) VALUES (?, ?)",
-        (chunk_id, serialize_f32(embedding)),
+        f"INSERT INTO chunk_embeddings (rowid, embedding) VALUES (?, {placeholder})",
+        (chunk_id, blobs[0]),
     )
     return chunk_id
 
 
+def insert_chunks_bulk(conn: sqlite3.Connection, chunks: list[dict], embeddings: list[list[float]]) -> list[int]:
+    """Insert many chunks and their embeddings in a single transaction. Returns the chunk ids.
+
+    Each chunk is a {text, page, block_index} dict; ids are pre-assigned so the
+    embedding rows can be inserted with executemany as well.
+    """
+    with conn:
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()[0]
+        ids = list(range(start, start + len(chunks)))
+        conn.executemany(
+            "INSERT INTO chunks (id, text, page, block_index) VALUES (?, ?, ?, ?)",
+            [(chunk_id, c["text"], c["page"], c["block_index"]) for chunk_id, c in zip(ids, chunks)],
+        )
+        blobs, placeholder = _encode_embeddings(conn, embeddings, store_scale=True)
+        conn.executemany(
+            f"INSERT INTO chunk_embeddings (rowid, embedding) VALUES (?, {placeholder})",
+            list(zip(ids, blobs)),
+        )
+    return ids
+
+
 def search(conn: sqlite3.Connection, query_embedding: list[float], top_k: int = 5) -> list[dict]:
-    """Search for the most similar chunks. Returns list of {id, text, page, block_index, distance}."""
+    """Search for the most similar chunks. Returns list of {id, text, page, block_index, distance}.
+
+    distance is the L2 distance between unit vectors (0 = identical, 2 = opposite);
+    int8 distances are divided by the database's scale to get back to those units.
+    """
+    blobs, placeholder = _encode_embeddings(conn, [query_embedding])
+    unit = _get_int8_scale(conn) or 1.0
     rows = conn.execute(
-        """
+        f"""
         SELECT c.id, c.text, c.page, c.block_index, v.distance
         FROM chunk_embeddings v
         JOIN chunks c ON c.id = v.rowid
-        WHERE v.embedding MATCH ? AND k = ?
+        WHERE v.embedding MATCH {placeholder} AND k = ?
         ORDER BY v.distance
         """,
-        (serialize_f32(query_embedding), top_k),
+        (blobs[0], top_k),
     ).fetchall()
     return [
-        {"id": r[0], "text": r[1], "page": r[2], "block_index": r[3], "distance": r[4]}
+        {"id": r[0], "text": r[1], "page": r[2], "block_index": r[3], "distance": r[4] / unit}
         for r in rows
     ]
@@ -1,54 +1,112 @@
 """PDF ingestion pipeline: text extraction, image description, chunking, embedding."""
 
+import asyncio
 import base64
-import json
+import hashlib
+import io
 import logging
 import re
 import unicodedata
 from pathlib import Path
 
 import fitz  # PyMuPDF
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI
+from PIL import Image
 
 import db
+import pages
 
 logger = logging.getLogger(__name__)
 
 RESEARCH_DIR = Path(__file__).parent
+# Shared across all PDFs: image descriptions keyed by content hash
+CACHE_DB_PATH = RESEARCH_DIR / "cache.db"
+
+# Max concurrent gpt-4o-mini image description requests
+DESCRIBE_CONCURRENCY = 16
+# Images are downscaled to at most this many px per side before being described
+VISION_MAX_SIDE = 1024
+# Max concurrent embedding batch requests
+EMBED_CONCURRENCY = 6
+
+_NON_WORD = re.compile(r"[^\w\s-]")
+_DASHES = re.compile(r"[-\s]+")
+
+
+def init_worker(page_workers: int) -> None:
+    """Initializer for ingestion worker processes: log like the server, share the cores."""
+    logging.basicConfig(level=logging.INFO)
+    pages.MAX_WORKERS = page_workers
 
 
 def slugify(text: str) -> str:
     """Convert text to a filename-safe slug."""
     text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
-    text = re.sub(r"[^\w\s-]", "", text.lower())
-    text = re.sub(r"[-\s]+", "-", text).strip("-")
+    text = _NON_WORD.sub("", text.lower())
+    text = _DASHES.sub("-", text).strip("-")
     return text[:80]
 
 
 def update_status(meta_path: Path, stage: str, **extra):
     """Update meta.json with current ingestion status."""
-    meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+    meta = orjson.loads(meta_path.read_bytes()) if meta_path.exists() else {}
     meta["status"] = stage
     meta.update(extra)
-    meta_path.write_text(json.dumps(meta, indent=2))
+    meta_path.write_bytes(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
 
 
-def extract_fulltext(doc: fitz.Document) -> str:
-    """Extract full text from PDF with page markers."""
-    pages = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text("text")
-        pages.append(f"--- PAGE {page_num + 1} ---\n{text}")
-    return "\n\n".join(pages)
-
+def shrink_for_vision(image_bytes: bytes, ext: str) -> tuple[bytes, str]:
+    """Downscale to VISION_MAX_SIDE px and re-encode as JPEG. Returns (bytes, ext).
 
-def extract_and_describe_images(doc: fitz.Document, img_dir: Path, client: OpenAI) -> list[dict]:
-    """Extract images from PDF, describe with gpt-4o-mini, save with descriptive names."""
+    Falls back to the original image if Pillow can't decode it.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE))
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, "JPEG", quality=85)
+    except Exception:
+        return image_bytes, ext
+    return buf.getvalue(), "jpeg"
+
+
+async def describe_image(image_bytes: bytes, ext: str, page_num: int, client: AsyncOpenAI) -> str | None:
+    """Describe an image in a few words with gpt-4o-mini, for use as a filename. None on failure."""
+    send_bytes, send_ext = await asyncio.to_thread(shrink_for_vision, image_bytes, ext)
+    b64 = base64.b64encode(send_bytes).decode()
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": (
+                        "Describe this image in 5-10 words for a filename. "
+                        "Be specific about what it shows (e.g. 'training loss curve over epochs'). "
+                        "Only output the description, nothing else."
+                    )},
+                    {"type": "image_url", "image_url": {"url": f"data:image/{send_ext};base64,{b64}"}}
+                ]
+            }],
+            max_tokens=50,
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.warning(f"Failed to describe image on page {page_num + 1}: {e}")
+        return None
+
+
+async def extract_and_describe_images(doc: fitz.Document, img_dir: Path, client: AsyncOpenAI) -> list[dict]:
+    """Extract images from PDF, describe with gpt-4o-mini, save with descriptive names.
+
+    Descriptions are looked up by content hash in the shared cache DB first; the
+    rest are requested concurrently (at most DESCRIBE_CONCURRENCY in flight).
+    """
     img_dir.mkdir(exist_ok=True)
-    images = []
-    fig_num = 0
 
+    # Collect images up front, in page order
+    extracted = []
     for page_num in range(len(doc)):
         page = doc[page_num]
         for img_info in page.get_images(full=True):
@@ -58,106 +116,93 @@ def extract_and_describe_images(doc: fitz.Document, img_dir: Path, client: OpenA
             except Exception:
                 continue
             image_bytes = base_image["image"]
-            ext = base_image["ext"]
 
             # Skip tiny images (icons, bullets, etc.)
             if len(image_bytes) < 5000:
                 continue
 
-            # Get description from gpt-4o-mini
-            b64 = base64.b64encode(image_bytes).decode()
-            try:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": (
-                                "Describe this image in 5-10 words for a filename. "
-                                "Be specific about what it shows (e.g. 'training loss curve over epochs'). "
-                                "Only output the description, nothing else."
-                            )},
-                            {"type": "image_url", "image_url": {"url": f"data:image/{ext};base64,{b64}"}}
-                        ]
-                    }],
-                    max_tokens=50,
-                )
-                description = response.choices[0].message.content.strip()
-            except Exception as e:
-                logger.warning(f"Failed to describe image on page {page_num + 1}: {e}")
-                description = f"image-page-{page_num + 1}"
-
-            slug_desc = slugify(description)
-            fig_num += 1
-            filename = f"fig{fig_num}-{slug_desc}.{ext}"
-            (img_dir / filename).write_bytes(image_bytes)
-            images.append({"filename": filename, "page": page_num + 1, "description": description})
+            image_hash = hashlib.sha256(image_bytes).digest()
+            extracted.append((image_hash, page_num, image_bytes, base_image["ext"]))
+
+    db.init_cache_db(CACHE_DB_PATH)
+    cache_conn = db.get_connection(CACHE_DB_PATH)
+    descriptions = db.get_cached_descriptions(cache_conn, [h for h, *_ in extracted])
+
+    # Describe each uncached image once, even if it repeats within the document
+    misses = {}
+    for image_hash, page_num, image_bytes, ext in extracted:
+        if image_hash not in descriptions:
+            misses.setdefault(image_hash, (page_num, image_bytes, ext))
+    logger.info(f"Image description cache: {len(extracted) - len(misses)} hits, {len(misses)} misses")
+
+    sem = asyncio.Semaphore(DESCRIBE_CONCURRENCY)
+
+    async def describe_one(image_bytes: bytes, ext: str, page_num: int) -> str | None:
+        async with sem:
+            return await describe_image(image_bytes, ext, page_num, client)
+
+    described = await asyncio.gather(*[
+        describe_one(image_bytes, ext, page_num) for page_num, image_bytes, ext in misses.values()
+    ])
+    new_descriptions = {h: d for h, d in zip(misses, described) if d}
+    db.cache_descriptions(cache_conn, new_descriptions)
+    cache_conn.close()
+    descriptions.update(new_descriptions)
+
+    # extracted is in page order, so fig numbers stay deterministic
+    images = []
+    for fig_num, (image_hash, page_num, image_bytes, ext) in enumerate(extracted, 1):
+        description = descriptions.get(image_hash) or f"image-page-{page_num + 1}"
+        slug_desc = slugify(description)
+        filename = f"fig{fig_num}-{slug_desc}.{ext}"
+        (img_dir / filename).write_bytes(image_bytes)
+        images.append({"filename": filename, "page": page_num + 1, "description": description})
 
     return images
 
 
-def heuristic_chunk(doc: fitz.Document) -> list[dict]:
+def heuristic_chunk(page_blocks: list[list[tuple[str, bool]]]) -> list[dict]:
     """Split PDF into chunks using font-size changes and paragraph gaps.
 
+    Takes the per-page (block_text, is_heading) lists from walk_pages.
     Returns list of {text, page, block_index}.
     Target: ~200-400 words per chunk.
     """
     chunks = []
     current_text = ""
+    current_word_count = 0
     current_page = 1
     current_block_idx = 0
     block_counter = 0
 
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        blocks = page.get_text("dict")["blocks"]
-
-        for block in blocks:
-            if block.get("type") != 0:  # text blocks only
-                continue
-
-            block_text = ""
-            is_heading = False
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    text = span.get("text", "").strip()
-                    if not text:
-                        continue
-                    font_size = span.get("size", 12)
-                    # Heuristic: font size > 14 likely a heading
-                    if font_size > 14:
-                        is_heading = True
-                    block_text += text + " "
-                block_text += "\n"
-
-            block_text = block_text.strip()
-            if not block_text:
-                continue
-
+    for page_num, blocks in enumerate(page_blocks):
+        for block_text, is_heading in blocks:
             block_counter += 1
 
             # Start new chunk on headings or when current chunk is large enough
-            word_count = len(current_text.split())
-            if is_heading and current_text.strip() and word_count > 50:
+            if is_heading and current_word_count > 50:
                 chunks.append({
                     "text": current_text.strip(),
                     "page": current_page,
                     "block_index": current_block_idx,
                 })
                 current_text = ""
+                current_word_count = 0
                 current_page = page_num + 1
                 current_block_idx = block_counter
 
             current_text += block_text + "\n\n"
+            current_word_count += len(block_text.split())
 
             # Split if we exceed ~400 words
-            if len(current_text.split()) >= 400:
+            if current_word_count >= 400:
                 chunks.append({
                     "text": current_text.strip(),
                     "page": current_page,
                     "block_index": current_block_idx,
                 })
                 current_text = ""
+                current_word_count = 0
                 current_page = page_num + 1
                 current_block_idx = block_counter + 1
 
@@ -172,24 +217,35 @@ def heuristic_chunk(doc: fitz.Document) -> list[dict]:
     return chunks
 
 
-def embed_chunks(chunks: list[dict], client: OpenAI) -> list[list[float]]:
-    """Embed all chunks in batches via OpenAI."""
+async def embed_chunks(chunks: list[dict], client: AsyncOpenAI) -> list[list[float]]:
+    """Embed all chunks in batches via OpenAI, with up to EMBED_CONCURRENCY batches in flight."""
     texts = [c["text"] for c in chunks]
-    embeddings = []
+
+    # Sort longest-first so each batch holds texts of similar length (evens out per-batch tokens)
+    order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    sorted_texts = [texts[i] for i in order]
 
     # OpenAI allows up to 2048 inputs per batch
     batch_size = 512
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
-        resp = client.embeddings.create(model="text-embedding-3-small", input=batch)
-        embeddings.extend([d.embedding for d in resp.data])
+    batches = [sorted_texts[i : i + batch_size] for i in range(0, len(sorted_texts), batch_size)]
+    results: list[list[list[float]] | None] = [None] * len(batches)
+    sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def sem_embed(i: int, batch: list[str]) -> None:
+        async with sem:
+            resp = await client.embeddings.create(model="text-embedding-3-small", input=batch)
+        results[i] = [d.embedding for d in resp.data]
 
+    await asyncio.gather(*[sem_embed(i, batch) for i, batch in enumerate(batches)])
+
+    # Scatter back to the original chunk order
+    embeddings: list[list[float] | None] = [None] * len(texts)
+    for j, emb in enumerate(emb for batch_embs in results for emb in batch_embs):
+        embeddings[order[j]] = emb
     return embeddings
 
 
-def generate_claude_md(slug_dir: Path) -> None:
-    """Generate the per-PDF CLAUDE.md that instructs claude -p."""
-    content = f"""# PDF Research Context
+_CLAUDE_MD_TEMPLATE = """# PDF Research Context
 
 You are answering questions about this document.
 
@@ -197,7 +253,7 @@ You are answering questions about this document.
 
 Run:
 ```
-uv run python {RESEARCH_DIR}/search_cli.py "query" --db chunks.db --top 5
+uv run python {research_dir}/search_cli.py "query" --db chunks.db --top 5
 ```
 
 Replace "query" with a search query derived from the user's question.
@@ -234,7 +290,17 @@ and analyze those images if they would help answer the question.
   expressions with `$...$` for inline and `$$...$$` for display math
 - Keep answers focused and substantive — no filler
 """
-    (slug_dir / "CLAUDE.md").write_text(content)
+
+
+async def with_openai(fn, *args):
+    """Await fn(*args, client) with an AsyncOpenAI client that is closed before the event loop ends."""
+    async with AsyncOpenAI() as client:
+        return await fn(*args, client)
+
+
+def generate_claude_md(slug_dir: Path) -> None:
+    """Generate the per-PDF CLAUDE.md that instructs claude -p."""
+    (slug_dir / "CLAUDE.md").write_text(_CLAUDE_MD_TEMPLATE.format(research_dir=RESEARCH_DIR))
 
 
 def ingest_pdf(slug: str) -> None:
@@ -244,29 +310,28 @@ def ingest_pdf(slug: str) -> None:
     meta_path = slug_dir / "meta.json"
     db_path = slug_dir / "chunks.db"
 
-    client = OpenAI()
     doc = fitz.open(str(pdf_path))
 
     # Update meta with page count and title
     title = doc.metadata.get("title", "") or slug.replace("-", " ").title()
     update_status(meta_path, "extracting", title=title, pages=len(doc))
 
-    # 1. Extract full text
+    # 1. Extract full text and chunk blocks in one pass over the pages
     logger.info(f"[{slug}] Extracting text...")
-    fulltext = extract_fulltext(doc)
+    fulltext, page_blocks = pages.walk_pages(doc)
     (slug_dir / "fulltext.txt").write_text(fulltext)
 
     # 2. Extract and describe images
     update_status(meta_path, "describing_images", title=title, pages=len(doc))
     logger.info(f"[{slug}] Extracting and describing images...")
     img_dir = slug_dir / "img"
-    images = extract_and_describe_images(doc, img_dir, client)
+    images = asyncio.run(with_openai(extract_and_describe_images, doc, img_dir))
     logger.info(f"[{slug}] Described {len(images)} images")
 
     # 3. Heuristic chunking
     update_status(meta_path, "chunking", title=title, pages=len(doc))
     logger.info(f"[{slug}] Chunking text...")
-    chunks = heuristic_chunk(doc)
+    chunks = heuristic_chunk(page_blocks)
     logger.info(f"[{slug}] Created {len(chunks)} chunks")
 
     if not chunks:
@@ -277,15 +342,13 @@ def ingest_pdf(slug: str) -> None:
     # 4. Embed chunks
     update_status(meta_path, "embedding", title=title, pages=len(doc))
     logger.info(f"[{slug}] Embedding {len(chunks)} chunks...")
-    embeddings = embed_chunks(chunks, client)
+    embeddings = asyncio.run(with_openai(embed_chunks, chunks))
 
     # 5. Store in sqlite-vec
     logger.info(f"[{slug}] Storing in database...")
     db.init_db(db_path)
     conn = db.get_connection(db_path)
-    for chunk, emb in zip(chunks, embeddings):
-        db.insert_chunk(conn, chunk["text"], chunk["page"], chunk["block_index"], emb)
-    conn.commit()
+    db.insert_chunks_bulk(conn, chunks, embeddings)
     conn.close()
 
     # 6. Generate CLAUDE.md
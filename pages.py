@@ -0,0 +1,84 @@
+"""PDF page walking: fulltext and chunk blocks, extracted across worker processes.
+
+Pool workers import this module, so it deliberately depends on nothing but PyMuPDF.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+# Blocks longer than this are never treated as headings
+HEADING_MAX_CHARS = 200
+# Documents with fewer pages are extracted in-process. Starting a 2-worker pool costs
+# ~200 ms while a page takes ~2.5 ms, so the pool only breaks even at ~150 pages.
+PARALLEL_MIN_PAGES = 150
+
+# Upper bound on extraction processes per document. Ingest workers lower it (see
+# ingest.init_worker) so concurrent ingests don't each claim every core.
+MAX_WORKERS = os.cpu_count() or 1
+
+# Text-only "dict" extraction: skip embedding image data in the result
+_DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+
+def _map_pages(fn, pdf_path: str, page_count: int) -> list:
+    """Run fn(pdf_path, start, end) over page ranges across processes; concatenate results in page order.
+
+    fitz documents aren't picklable, so each worker reopens the file for its slice.
+    """
+    workers = min(MAX_WORKERS, page_count)
+    if page_count < PARALLEL_MIN_PAGES or workers < 2:
+        return fn(pdf_path, 0, page_count)
+
+    step = -(-page_count // workers)  # ceil division
+    starts = range(0, page_count, step)
+    ends = [min(start + step, page_count) for start in starts]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(fn, [pdf_path] * len(starts), starts, ends)
+        return [item for part in parts for item in part]
+
+
+def _is_heading(block: dict) -> bool:
+    """Check whether a "dict" text block uses a heading-sized font."""
+    for line in block.get("lines", []):
+        for span in line.get("spans", []):
+            # Heuristic: font size > 14 likely a heading
+            if span.get("text", "").strip() and span.get("size", 12) > 14:
+                return True
+    return False
+
+
+def _extract_pages_range(pdf_path: str, start: int, end: int) -> list[tuple[str, list[tuple[str, bool]]]]:
+    """Extract (page_text, [(block_text, is_heading), ...]) for pages [start, end).
+
+    One get_text("dict") call per page is the only layout pass; it feeds both the
+    fulltext and the chunker, and its spans carry the font sizes for heading detection.
+    """
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(start, end):
+            page_text = []
+            blocks = []
+            for block in doc[page_num].get_text("dict", flags=_DICT_FLAGS)["blocks"]:
+                if block.get("type") != 0:  # text blocks only
+                    continue
+                lines = ["".join(span["text"] for span in line.get("spans", [])) for line in block.get("lines", [])]
+                page_text.append("".join(line + "\n" for line in lines))
+
+                lines = [" ".join(line.split()) for line in lines]
+                block_text = "\n".join(line for line in lines if line)
+                if not block_text:
+                    continue
+
+                is_heading = len(block_text) < HEADING_MAX_CHARS and _is_heading(block)
+                blocks.append((block_text, is_heading))
+            pages.append(("".join(page_text), blocks))
+    return pages
+
+
+def walk_pages(doc: fitz.Document) -> tuple[str, list[list[tuple[str, bool]]]]:
+    """Walk every page once, returning the fulltext (with page markers) and per-page chunk blocks."""
+    pages = _map_pages(_extract_pages_range, doc.name, len(doc))
+    fulltext = "\n\n".join(f"--- PAGE {page_num + 1} ---\n{text}" for page_num, (text, _) in enumerate(pages))
+    return fulltext, [blocks for _, blocks in pages]
@@ -27,7 +27,7 @@ def main():
     resp = client.embeddings.create(model="text-embedding-3-small", input=args.query)
     query_embedding = resp.data[0].embedding
 
-    conn = db.get_connection(args.db)
+    conn = db.get_readonly_connection(args.db)
     results = db.search(conn, query_embedding, top_k=args.top)
     conn.close()
 
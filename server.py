@@ -1,19 +1,21 @@
 """FastAPI server: upload, status, PDF serving, Q&A streaming."""
 
 import asyncio
-import json
+import functools
 import logging
-import re
-import unicodedata
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, BackgroundTasks
+from fastapi import FastAPI, UploadFile
 from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
-from ingest import ingest_pdf
+from ingest import ingest_pdf, init_worker, slugify, update_status
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -23,16 +25,86 @@ RESEARCH_DIR = Path(__file__).parent
 PDFS_DIR = RESEARCH_DIR / "pdfs"
 PDFS_DIR.mkdir(exist_ok=True)
 
+# Ingestion runs in separate processes so PyMuPDF work never holds up the server.
+# Each ingest may fan page extraction out further; split the cores between the two
+# levels so a full pool runs about one process per core.
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+
+def new_ingest_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=INGEST_WORKERS,
+        initializer=init_worker,
+        initargs=(max(1, (os.cpu_count() or 1) // INGEST_WORKERS),),
+    )
+
+
+INGEST_POOL = new_ingest_pool()
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+STREAM_READ_SIZE = 1 << 16  # 64 KiB reads from claude -p stdout
+
 app = FastAPI()
 
 
 def make_slug(filename: str) -> str:
     """Create a filesystem-safe slug from a filename."""
-    name = Path(filename).stem
-    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
-    text = re.sub(r"[^\w\s-]", "", text.lower())
-    text = re.sub(r"[-\s]+", "-", text).strip("-")
-    return text[:80] or "document"
+    return slugify(Path(filename).stem) or "document"
+
+
+async def save_upload(file: UploadFile, dst: Path) -> None:
+    """Stream an upload to disk in chunks, so memory use doesn't grow with file size."""
+    with open(dst, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await asyncio.to_thread(out.write, chunk)
+
+
+async def iter_lines(reader: asyncio.StreamReader):
+    """Yield newline-delimited lines as bytes, reading in large chunks.
+
+    Unlike `async for line in reader`, lines longer than the reader's limit
+    (e.g. big tool-call events) don't raise LimitOverrunError.
+    """
+    partial = bytearray()  # start of a line whose newline hasn't arrived yet
+    while chunk := await reader.read(STREAM_READ_SIZE):
+        # Only the new chunk is scanned, so a huge line costs O(n), not O(n^2)
+        *lines, rest = chunk.split(b"\n")
+        for line in lines:
+            if partial:
+                partial += line
+                line = bytes(partial)
+                partial.clear()
+            yield line
+        partial += rest
+    if partial:
+        yield bytes(partial)
+
+
+def handle_ingest_failure(slug: str, future: Future) -> None:
+    """Done-callback for ingestion jobs, which are never awaited.
+
+    Marks the PDF as failed in meta.json so the UI stops polling.
+    """
+    if exc := future.exception():
+        logger.error(f"[{slug}] Ingestion failed", exc_info=exc)
+        update_status(PDFS_DIR / slug / "meta.json", "error", error=str(exc) or type(exc).__name__)
+
+
+def submit_ingest(slug: str) -> None:
+    """Queue ingest_pdf on the pool, replacing the pool once if a crashed worker broke it."""
+    global INGEST_POOL
+    for _ in range(2):
+        try:
+            future = INGEST_POOL.submit(ingest_pdf, slug)
+        except BrokenProcessPool:
+            logger.warning(f"[{slug}] Ingest pool is broken, starting a new one")
+            INGEST_POOL.shutdown(wait=False)
+            INGEST_POOL = new_ingest_pool()
+            continue
+        future.add_done_callback(functools.partial(handle_ingest_failure, slug))
+        return
+    logger.error(f"[{slug}] Could not start ingestion: pool keeps breaking")
+    update_status(PDFS_DIR / slug / "meta.json", "error", error="Ingestion worker pool unavailable")
 
 
 # --- API Endpoints ---
@@ -41,24 +113,24 @@ def make_slug(filename: str) -> str:
 @app.get("/api/pdfs")
 async def list_pdfs():
     """List all PDFs with their status."""
-    pdfs = []
     if not PDFS_DIR.exists():
-        return pdfs
-    for slug_dir in sorted(PDFS_DIR.iterdir()):
-        if not slug_dir.is_dir():
-            continue
-        meta_path = slug_dir / "meta.json"
-        if meta_path.exists():
-            meta = json.loads(meta_path.read_text())
-        else:
-            meta = {"status": "unknown"}
+        return []
+    slug_dirs = [d for d in sorted(PDFS_DIR.iterdir()) if d.is_dir()]
+    meta_paths = [d / "meta.json" for d in slug_dirs]
+
+    async def read_meta(meta_path: Path) -> dict:
+        if not meta_path.exists():
+            return {"status": "unknown"}
+        return orjson.loads(await asyncio.to_thread(meta_path.read_bytes))
+
+    pdfs = await asyncio.gather(*[read_meta(p) for p in meta_paths])
+    for slug_dir, meta in zip(slug_dirs, pdfs):
         meta["slug"] = slug_dir.name
-        pdfs.append(meta)
     return pdfs
 
 
 @app.post("/api/upload")
-async def upload_pdf(file: UploadFile, background_tasks: BackgroundTasks):
+async def upload_pdf(file: UploadFile):
     """Upload a PDF and start background ingestion."""
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         return {"error": "Only PDF files are accepted"}, 400
@@ -78,15 +150,14 @@ async def upload_pdf(file: UploadFile, background_tasks: BackgroundTasks):
 
     # Save PDF
     pdf_path = slug_dir / "document.pdf"
-    content = await file.read()
-    pdf_path.write_bytes(content)
+    await save_upload(file, pdf_path)
 
     # Initial meta
     meta = {"status": "queued", "title": slug.replace("-", " ").title(), "slug": slug}
-    (slug_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    await asyncio.to_thread((slug_dir / "meta.json").write_bytes, orjson.dumps(meta, option=orjson.OPT_INDENT_2))
 
-    # Start background ingestion
-    background_tasks.add_task(ingest_pdf, slug)
+    # Start background ingestion (fire-and-forget; progress is tracked in meta.json)
+    submit_ingest(slug)
 
     return {"slug": slug, "status": "queued"}
 
@@ -97,7 +168,7 @@ async def pdf_status(slug: str):
     meta_path = PDFS_DIR / slug / "meta.json"
     if not meta_path.exists():
         return {"error": "Not found"}, 404
-    return json.loads(meta_path.read_text())
+    return orjson.loads(meta_path.read_bytes())
 
 
 @app.get("/api/pdfs/{slug}/pdf")
@@ -131,7 +202,9 @@ async def ask_question(slug: str, req: AskRequest):
     prompt = "\n\n".join(prompt_parts)
 
     async def stream_response():
-        sent_text = set()  # track text we've already sent to avoid duplicates
+        # Track text we've already sent to avoid duplicates. stream-json emits each assistant
+        # message separately (not cumulatively), so a length cursor would drop later messages.
+        sent_text = set()
 
         try:
             process = await asyncio.create_subprocess_exec(
@@ -144,13 +217,13 @@ async def ask_question(slug: str, req: AskRequest):
                 stderr=asyncio.subprocess.PIPE,
             )
 
-            async for line in process.stdout:
-                line = line.decode("utf-8").strip()
+            async for line in iter_lines(process.stdout):
+                line = line.strip()
                 if not line:
                     continue
                 try:
-                    event = json.loads(line)
-                except json.JSONDecodeError:
+                    event = orjson.loads(line)
+                except orjson.JSONDecodeError:
                     continue
 
                 event_type = event.get("type")
@@ -163,19 +236,19 @@ async def ask_question(slug: str, req: AskRequest):
                             text = block["text"]
                             if text not in sent_text:
                                 sent_text.add(text)
-                                yield f"data: {json.dumps({'text': text})}\n\n"
+                                yield f"data: {orjson.dumps({'text': text}).decode()}\n\n"
 
                 # Final result — use result text if nothing streamed yet
                 elif event_type == "result":
                     result_text = event.get("result", "")
                     if result_text and not sent_text:
-                        yield f"data: {json.dumps({'text': result_text, 'final': True})}\n\n"
+                        yield f"data: {orjson.dumps({'text': result_text, 'final': True}).decode()}\n\n"
 
             await process.wait()
 
         except Exception as e:
             logger.error(f"Error in Q&A stream: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield f"data: {orjson.dumps({'error': str(e)}).decode()}\n\n"
 
         yield "data: [DONE]\n\n"
 
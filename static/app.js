@@ -161,6 +161,13 @@ async function pollStatus(slug) {
             statusPollInterval = null;
         }
         await loadPdfList();
+    } else if (meta.status === "error") {
+        statusIndicator.className = "error";
+        statusIndicator.textContent = `Ingestion failed: ${meta.error || "unknown error"}`;
+        if (statusPollInterval) {
+            clearInterval(statusPollInterval);
+            statusPollInterval = null;
+        }
     } else {
         statusIndicator.className = "active";
     }